@@ -1,17 +1,22 @@
 import os
 import uuid
+import hashlib
+import logging
 import tempfile
-import shutil
 from contextlib import asynccontextmanager
-
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends
-from sqlalchemy import select, func
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, ORJSONResponse
+from pydantic import BaseModel
+from sqlalchemy import select, func, update, delete
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from imagekitio.models.UploadFileRequestOptions import UploadFileRequestOptions
 
-from app.schemas import PostCreate, PostResponse, UserRead, UserCreate, UserUpdate, CommentCreate, CommentResponse, LikeCreate, LikeResponse
-from app.db import Post, create_db_and_tables, get_async_session, User, Comment, Like
-from app.images import imagekit
+from app.schemas import PostCreate, PostResponse, UserRead, UserCreate, UserUpdate, CommentCreate, CommentResponse, LikeCreate, LikeResponse, PostRead, FeedResponse, CommentRead, CommentListResponse, dump_items
+from app.db import Post, create_db_and_tables, get_async_session, User, Comment, Like, MediaBlob
+from app.images import storage, media_type, MEDIA_TYPES
 from app.users import auth_backend, current_active_user, fastapi_users
 
 
@@ -21,6 +26,7 @@ async def lifespan(app: FastAPI):
     yield
 
 app = FastAPI(lifespan=lifespan)
+logger = logging.getLogger(__name__)
 
 app.include_router(fastapi_users.get_auth_router(auth_backend), prefix='/auth/jwt', tags=["auth"])
 app.include_router(fastapi_users.get_register_router(UserRead, UserCreate), prefix="/auth", tags=["auth"])
@@ -28,6 +34,85 @@ app.include_router(fastapi_users.get_reset_password_router(), prefix="/auth", ta
 app.include_router(fastapi_users.get_verify_router(UserRead), prefix="/auth", tags=["auth"])
 app.include_router(fastapi_users.get_users_router(UserRead, UserUpdate), prefix="/users", tags=["users"])
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Stored media files are never rewritten in place, so clients may cache them forever
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MEDIA_EXTENSIONS = {extension: mime_type for mime_type, extension in MEDIA_TYPES.items()}
+
+
+@app.get("/media/{file_id:path}")
+@app.head("/media/{file_id:path}", include_in_schema=False)
+async def get_media(file_id: str):
+    path = storage.resolve(file_id)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    # Media is served from the API's own origin, so never let a browser render it as a document
+    headers = {
+        "Cache-Control": MEDIA_CACHE_CONTROL,
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "sandbox",
+    }
+    mime_type = MEDIA_EXTENSIONS.get(path.suffix.lower())
+    if mime_type is None:
+        return FileResponse(
+            path, media_type="application/octet-stream", headers=headers,
+            filename=path.name, content_disposition_type="attachment"
+        )
+
+    # FileResponse streams the file in chunks and answers Range / If-None-Match itself.
+    # Serving is only zero-copy behind an ASGI server with the pathsend extension, not uvicorn.
+    return FileResponse(path, media_type=mime_type, headers=headers)
+
+
+def build_srcset(variants: list[dict], fmt: str = "webp") -> Optional[str]:
+    """HTML srcset over the variants of one format, or None for posts without variants."""
+    # Keyed by width: a srcset may not repeat a width descriptor
+    candidates = {v["width"]: f"{v['url']} {v['width']}w" for v in reversed(variants) if v["format"] == fmt}
+    return ", ".join(candidates[width] for width in sorted(candidates)) or None
+
+
+def parse_fields(fields: Optional[str], model: type[BaseModel]) -> Optional[set[str]]:
+    """Fields requested through a comma-separated `fields=` parameter, or None for all of them."""
+    if not fields:
+        return None
+    selected = {name.strip() for name in fields.split(",") if name.strip()}
+    if not selected:
+        raise HTTPException(status_code=400, detail="fields must name at least one field")
+    unknown = selected - model.model_fields.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return selected
+
+
+FIELDS_QUERY = Query(None, description="Comma-separated list of fields to return, e.g. id,like_count")
+
+
+async def claim_blob(session: AsyncSession, content_hash: str):
+    """Add a reference to the blob with this hash; returns its url and file_name, or None if there is none."""
+    result = await session.execute(
+        update(MediaBlob)
+        .where(MediaBlob.sha256 == content_hash)
+        .values(ref_count=MediaBlob.ref_count + 1)
+        .returning(MediaBlob.url, MediaBlob.file_name)
+    )
+    return result.first()
+
+
+async def discard_media(file_id: Optional[str], variants: Optional[list[dict]]):
+    """Remove a stored file and its variants from the storage backend.
+
+    Failures are logged and the file left behind for cleanup, so callers that have already
+    committed their database change still succeed.
+    """
+    file_ids = [file_id] + [v.get("file_id") for v in variants or []]
+    for file_id in filter(None, file_ids):
+        try:
+            await run_in_threadpool(storage.delete, file_id)
+        except Exception:
+            logger.exception("Could not delete stored media %s", file_id)
+
+
 @app.post("/upload")
 async def upload_file(
         file: UploadFile = File(...),
@@ -38,32 +123,85 @@ async def upload_file(
     temp_file_path = None
 
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
+        # Hash while spooling to disk so identical media is detected without a second pass
+        sha256 = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(
+                delete=False, dir=storage.spool_dir, prefix=".upload-", suffix=os.path.splitext(file.filename)[1]
+        ) as temp_file:
             temp_file_path = temp_file.name
-            shutil.copyfileobj(file.file, temp_file)
-
-        upload_result = imagekit.upload_file(
-            file=open(temp_file_path, "rb"),
-            file_name=file.filename,
-            options=UploadFileRequestOptions(
-                use_unique_file_name=True,
-                tags=["backend-upload"]
-            )
-        )
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                sha256.update(chunk)
+                temp_file.write(chunk)
+        content_hash = sha256.hexdigest()
+
+        # Store under an extension derived from the verified type, never the client's file name
+        mime_type = media_type(temp_file_path, file.content_type)
+        if mime_type is None:
+            raise HTTPException(status_code=415, detail="Only image and video uploads are supported")
+        file_name = os.path.splitext(file.filename)[0] + MEDIA_TYPES[mime_type]
+        file_type = "video" if mime_type.startswith("video/") else "image"
+        user_id = user.id
+
+        # Read-only lookup, so no write lock is held while the media is being stored
+        result = await session.execute(select(MediaBlob.id).where(MediaBlob.sha256 == content_hash))
+        known = result.first() is not None
+        await session.commit()
+
+        stored = None
+        variants = []
+        blob = None
+        try:
+            if not known:
+                stored = await run_in_threadpool(storage.save, temp_file_path, file_name, content_hash)
+                if stored is None:
+                    raise HTTPException(status_code=502, detail="Media store rejected the upload")
+                if file_type == "image":
+                    variants = await run_in_threadpool(storage.make_variants, temp_file_path, stored)
+
+                session.add(MediaBlob(
+                    sha256=content_hash,
+                    url=stored.url,
+                    file_name=stored.file_name,
+                    file_id=stored.file_id,
+                    ref_count=1,
+                    variants=variants
+                ))
+                try:
+                    await session.flush()
+                    blob = stored
+                except IntegrityError:
+                    # A concurrent upload stored the same content first; reuse theirs
+                    await session.rollback()
+                    await discard_media(stored.file_id, variants)
+                    stored = None
+
+            # Reuse the existing asset on a hash hit
+            if blob is None:
+                blob = await claim_blob(session, content_hash)
+            if blob is None:
+                raise HTTPException(status_code=409, detail="Media was removed during upload, please retry")
 
-        if upload_result.response_metadata.http_status_code == 200:
             post = Post(
-                user_id=user.id,
+                user_id=user_id,
                 caption=caption,
-                url=upload_result.url,
-                file_type="video" if file.content_type.startswith("video/") else "image",
-                file_name=upload_result.name
+                url=blob.url,
+                file_type=file_type,
+                file_name=blob.file_name
             )
             session.add(post)
             await session.commit()
-            await session.refresh(post)
-            return post
-
+            stored = None
+        except BaseException:
+            if stored is not None:
+                await session.rollback()
+                await discard_media(stored.file_id, variants)
+            raise
+
+        await session.refresh(post)
+        return post
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
@@ -71,11 +209,17 @@ async def upload_file(
             os.unlink(temp_file_path)
         file.file.close()
 
-@app.get("/feed")
+@app.get("/feed", response_model=FeedResponse, response_class=ORJSONResponse)
 async def get_feed(
+        fields: Optional[str] = FIELDS_QUERY,
         session: AsyncSession = Depends(get_async_session),
         user: User = Depends(current_active_user),
 ):
+    selected = parse_fields(fields, PostRead)
+
+    def wants(name):
+        return selected is None or name in selected
+
     # Get posts
     result = await session.execute(select(Post).order_by(Post.created_at.desc()))
     posts = [row[0] for row in result.all()]
@@ -85,38 +229,56 @@ async def get_feed(
     users = [row[0] for row in result.all()]
     user_dict = {u.id: u.email for u in users}
 
+    # Get precomputed image variants
+    variants_dict = {}
+    if wants("variants") or wants("srcset"):
+        result = await session.execute(
+            select(MediaBlob.file_name, MediaBlob.variants)
+            .where(MediaBlob.file_name.in_([p.file_name for p in posts if p.file_type == "image"]))
+        )
+        variants_dict = {row.file_name: row.variants or [] for row in result.all()}
+
     posts_data = []
     for post in posts:
+        like_count = comment_count = 0
+        is_liked = False
+
         # Get like count
-        like_count_result = await session.execute(select(func.count(Like.id)).where(Like.post_id == post.id))
-        like_count = like_count_result.scalar()
+        if wants("like_count"):
+            like_count_result = await session.execute(select(func.count(Like.id)).where(Like.post_id == post.id))
+            like_count = like_count_result.scalar()
 
         # Check if liked by current user
-        is_liked_result = await session.execute(select(Like).where(Like.post_id == post.id, Like.user_id == user.id))
-        is_liked = is_liked_result.scalars().first() is not None
+        if wants("is_liked"):
+            is_liked_result = await session.execute(select(Like).where(Like.post_id == post.id, Like.user_id == user.id))
+            is_liked = is_liked_result.scalars().first() is not None
 
         # Get comment count
-        comment_count_result = await session.execute(select(func.count(Comment.id)).where(Comment.post_id == post.id))
-        comment_count = comment_count_result.scalar()
-
-        posts_data.append(
-            {
-                "id": str(post.id),
-                "user_id": str(post.user_id),
-                "caption": post.caption,
-                "url": post.url,
-                "file_type": post.file_type,
-                "file_name": post.file_name,
-                "created_at": post.created_at.isoformat(),
-                "is_owner": post.user_id == user.id,
-                "email": user_dict.get(post.user_id, "Unknown"),
-                "like_count": like_count,
-                "comment_count": comment_count,
-                "is_liked": is_liked
-            }
-        )
-
-    return {"posts": posts_data}
+        if wants("comment_count"):
+            comment_count_result = await session.execute(select(func.count(Comment.id)).where(Comment.post_id == post.id))
+            comment_count = comment_count_result.scalar()
+
+        variants = variants_dict.get(post.file_name, [])
+
+        posts_data.append({
+            "id": post.id,
+            "user_id": post.user_id,
+            "caption": post.caption,
+            "url": post.url,
+            "file_type": post.file_type,
+            "file_name": post.file_name,
+            "created_at": post.created_at,
+            "is_owner": post.user_id == user.id,
+            "email": user_dict.get(post.user_id, "Unknown"),
+            "like_count": like_count,
+            "comment_count": comment_count,
+            "is_liked": is_liked,
+            "variants": {v["name"]: v["url"] for v in variants},
+            "srcset": build_srcset(variants)
+        })
+
+    # Returning the response directly skips FastAPI's jsonable_encoder pass
+    return ORJSONResponse({"posts": dump_items(PostRead, posts_data, selected)})
 
 
 @app.delete("/posts/{post_id}")
@@ -133,9 +295,23 @@ async def delete_post(post_id: str, session: AsyncSession = Depends(get_async_se
         if post.user_id != user.id:
             raise HTTPException(status_code=403, detail="You don't have permission to delete this post")
 
+        # Release this post's reference; the remote file goes away with the last one
+        result = await session.execute(
+            update(MediaBlob)
+            .where(MediaBlob.file_name == post.file_name)
+            .values(ref_count=MediaBlob.ref_count - 1)
+            .returning(MediaBlob.ref_count, MediaBlob.file_id, MediaBlob.variants)
+        )
+        blob = result.first()
+        if blob is not None and blob.ref_count <= 0:
+            await session.execute(delete(MediaBlob).where(MediaBlob.file_name == post.file_name))
+
         await session.delete(post)
         await session.commit()
 
+        if blob is not None and blob.ref_count <= 0:
+            await discard_media(blob.file_id, blob.variants)
+
         return {"success": True, "message": "Post deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -170,11 +346,14 @@ async def create_comment(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/posts/{post_id}/comments")
+@app.get("/posts/{post_id}/comments", response_model=CommentListResponse, response_class=ORJSONResponse)
 async def get_comments(
     post_id: str,
+    fields: Optional[str] = FIELDS_QUERY,
     session: AsyncSession = Depends(get_async_session)
 ):
+    selected = parse_fields(fields, CommentRead)
+
     try:
         post_uuid = uuid.UUID(post_id)
         result = await session.execute(
@@ -191,18 +370,17 @@ async def get_comments(
         else:
             user_map = {}
 
-        return {
-            "comments": [
-                {
-                    "id": str(c.id),
-                    "user_id": str(c.user_id),
-                    "email": user_map.get(c.user_id, "Unknown"),
-                    "content": c.content,
-                    "created_at": c.created_at.isoformat()
-                }
-                for c in comments
-            ]
-        }
+        comments_data = [
+            {
+                "id": c.id,
+                "user_id": c.user_id,
+                "email": user_map.get(c.user_id, "Unknown"),
+                "content": c.content,
+                "created_at": c.created_at
+            }
+            for c in comments
+        ]
+        return ORJSONResponse({"comments": dump_items(CommentRead, comments_data, selected)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,7 +1,7 @@
 from collections.abc import AsyncGenerator
 import uuid
 
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Integer, JSON
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, relationship
@@ -63,6 +63,21 @@ class Like(Base):
     post = relationship("Post", back_populates="likes")
 
 
+class MediaBlob(Base):
+    __tablename__ = "media_blobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    sha256 = Column(String(64), nullable=False, unique=True, index=True)
+    url = Column(String, nullable=False)
+    # Posts reference their blob through file_name, which is unique per remote asset
+    file_name = Column(String, nullable=False, unique=True, index=True)
+    file_id = Column(String)
+    ref_count = Column(Integer, nullable=False, default=1)
+    # Resized renditions generated at upload time, shared by every post using this blob
+    variants = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 engine = create_async_engine(DATABASE_URL)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
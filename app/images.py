@@ -1,11 +1,288 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
 from dotenv import load_dotenv
 from imagekitio import ImageKit
+from imagekitio.models.UploadFileRequestOptions import UploadFileRequestOptions
+from PIL import Image, ImageOps, UnidentifiedImageError
 import os
+import re
+import secrets
+import shutil
+import tempfile
+import warnings
 
 load_dotenv()
 
-imagekit = ImageKit(
-    private_key=os.getenv("IMAGEKIT_PRIVATE_KEY"),
-    public_key=os.getenv("IMAGEKIT_PUBLIC_KEY"),
-    url_endpoint=os.getenv("IMAGEKIT_URL"),
-)
\ No newline at end of file
+MEDIA_BACKEND = os.getenv("MEDIA_BACKEND", "imagekit")
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "./media")
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "http://localhost:8000")
+
+# (name, width, format) of the renditions generated for image posts; narrow sources
+# get a subset, see variant_specs
+IMAGE_VARIANTS = [
+    ("thumb", 320, "webp"),
+    ("feed", 720, "webp"),
+    ("feed_hd", 1280, "webp"),
+    ("feed_jpg", 720, "jpg"),
+]
+
+# Media types accepted for upload and the extension each is stored under. Only these are served
+# inline by /media, so a client-chosen extension can never make the API serve HTML or SVG.
+MEDIA_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "video/mp4": ".mp4",
+    "video/quicktime": ".mov",
+    "video/webm": ".webm",
+    "video/x-matroska": ".mkv",
+    "video/x-msvideo": ".avi",
+}
+IMAGE_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "GIF": "image/gif", "WEBP": "image/webp"}
+
+# Larger images are refused at upload, so they are never decoded
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 40_000_000))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+def image_header(path: str) -> Optional[tuple[str, int, int]]:
+    """(format, width, height) from the image header without decoding it, or None if it is
+    not an image or is larger than MAX_IMAGE_PIXELS."""
+    try:
+        with warnings.catch_warnings():
+            # Oversized images are rejected below; the warning would only add log noise
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(path) as image:
+                image_format = image.format
+                width, height = image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return None
+    if width * height > MAX_IMAGE_PIXELS:
+        return None
+    return image_format, width, height
+
+
+def image_width(path: str) -> Optional[int]:
+    """Width from the image header, or None if the file is not an image we are willing to resize."""
+    header = image_header(path)
+    return header[1] if header else None
+
+
+def media_type(path: str, content_type: Optional[str]) -> Optional[str]:
+    """Allowed MIME type of an upload, or None to refuse it.
+
+    Images are identified by Pillow from the file itself; videos by the declared type.
+    """
+    content_type = content_type or ""
+    if content_type.startswith("image/"):
+        header = image_header(path)
+        content_type = IMAGE_FORMATS.get(header[0]) if header else None
+    return content_type if content_type in MEDIA_TYPES else None
+
+
+def variant_specs(source_width: int) -> list[tuple[str, int, str]]:
+    """IMAGE_VARIANTS capped at the source width, keeping one variant per width and format."""
+    specs = []
+    seen = set()
+    for name, width, fmt in IMAGE_VARIANTS:
+        width = min(width, source_width)
+        if (width, fmt) not in seen:
+            seen.add((width, fmt))
+            specs.append((name, width, fmt))
+    return specs
+
+
+@dataclass
+class StoredMedia:
+    url: str
+    file_name: str
+    file_id: Optional[str] = None
+
+
+class StorageBackend(ABC):
+    """Where uploaded media lives and how it is addressed."""
+
+    # Directory uploads are spooled to before save(); None means the system temp dir
+    spool_dir: Optional[str] = None
+
+    @abstractmethod
+    def save(self, path: str, file_name: str, content_hash: str) -> Optional[StoredMedia]:
+        """Store the file at `path` and return its location, or None if the store rejected it."""
+
+    @abstractmethod
+    def delete(self, file_id: str) -> None:
+        ...
+
+    def resolve(self, file_id: str) -> Optional[Path]:
+        """Local path for a stored file; remote backends serve their own media."""
+        return None
+
+    def make_variants(self, path: str, stored: StoredMedia) -> list[dict]:
+        """Resized renditions of an image, as chosen by variant_specs.
+
+        Which variant names are present depends on the source width: names whose width and
+        format would duplicate a smaller variant are left out, so callers must not assume a
+        fixed set of keys.
+        """
+        return []
+
+
+class ImageKitBackend(StorageBackend):
+    def __init__(self):
+        self.client = ImageKit(
+            private_key=os.getenv("IMAGEKIT_PRIVATE_KEY"),
+            public_key=os.getenv("IMAGEKIT_PUBLIC_KEY"),
+            url_endpoint=os.getenv("IMAGEKIT_URL"),
+        )
+
+    def save(self, path: str, file_name: str, content_hash: str) -> Optional[StoredMedia]:
+        with open(path, "rb") as media:
+            upload_result = self.client.upload_file(
+                file=media,
+                file_name=file_name,
+                options=UploadFileRequestOptions(
+                    use_unique_file_name=True,
+                    tags=["backend-upload"]
+                )
+            )
+
+        if upload_result.response_metadata.http_status_code != 200:
+            return None
+        return StoredMedia(url=upload_result.url, file_name=upload_result.name, file_id=upload_result.file_id)
+
+    def delete(self, file_id: str) -> None:
+        self.client.delete_file(file_id=file_id)
+
+    def make_variants(self, path: str, stored: StoredMedia) -> list[dict]:
+        source_width = image_width(path)
+        if source_width is None:
+            return []
+
+        # ImageKit resizes on its CDN, so the variants are just transform URLs built once here
+        return [
+            {
+                "name": name,
+                "width": width,
+                "format": fmt,
+                "url": self.client.url({
+                    "src": stored.url,
+                    "transformation": [{"width": str(width), "format": fmt}],
+                }),
+            }
+            for name, width, fmt in variant_specs(source_width)
+        ]
+
+
+class LocalStorageBackend(StorageBackend):
+    """Stores media on local disk, sharded by content hash, served by the /media route."""
+
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip("/")
+        # Spooling inside the media root lets save() link the upload into place instead of copying it
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.spool_dir = str(self.root)
+
+    def save(self, path: str, file_name: str, content_hash: str) -> Optional[StoredMedia]:
+        # The extension was already chosen from MEDIA_TYPES by the caller
+        stem, ext = os.path.splitext(os.path.basename(file_name))
+        stem = re.sub(r"[^A-Za-z0-9_-]", "_", stem) or "file"
+        ext = ext if ext in MEDIA_TYPES.values() else ""
+        unique_name = f"{stem}_{secrets.token_hex(5)}{ext}"
+        file_id = f"{content_hash[:2]}/{content_hash[2:4]}/{unique_name}"
+
+        destination = self.root / file_id
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "rb") as source:
+            os.fsync(source.fileno())
+            os.chmod(path, 0o644)
+            try:
+                # The spooled file is complete, so linking it in publishes it atomically
+                os.link(path, destination)
+            except OSError:
+                # Spooled on another filesystem; fall back to copying
+                self._write_atomic(destination, lambda temp_file: shutil.copyfileobj(source, temp_file))
+
+        return StoredMedia(url=f"{self.base_url}/media/{file_id}", file_name=unique_name, file_id=file_id)
+
+    def make_variants(self, path: str, stored: StoredMedia) -> list[dict]:
+        source_width = image_width(path)
+        if source_width is None:
+            return []
+        try:
+            with Image.open(path) as original:
+                image = ImageOps.exif_transpose(original)
+                image.load()
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+            return []
+
+        base_id = os.path.splitext(stored.file_id)[0]
+        variants = []
+        try:
+            for name, width, fmt in variant_specs(image.width):
+                resized = image.copy()
+                resized.thumbnail((width, image.height))
+                if fmt == "jpg" and resized.mode != "RGB":
+                    resized = resized.convert("RGB")
+
+                file_id = f"{base_id}_{name}.{fmt}"
+                pil_format = "JPEG" if fmt == "jpg" else fmt.upper()
+                self._write_atomic(
+                    self.root / file_id,
+                    lambda temp_file: resized.save(temp_file, format=pil_format, quality=80),
+                )
+                variants.append({
+                    "name": name,
+                    "width": resized.width,
+                    "format": fmt,
+                    "url": f"{self.base_url}/media/{file_id}",
+                    "file_id": file_id,
+                })
+        except BaseException:
+            for variant in variants:
+                self.delete(variant["file_id"])
+            raise
+        return variants
+
+    def delete(self, file_id: str) -> None:
+        path = self.resolve(file_id)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    def resolve(self, file_id: str) -> Optional[Path]:
+        path = (self.root / file_id).resolve()
+        if not path.is_relative_to(self.root) or path.name.startswith("."):
+            return None
+        return path
+
+    @staticmethod
+    def _write_atomic(destination: Path, write: Callable) -> None:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write next to the destination and rename so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=destination.parent, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                write(temp_file)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, destination)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+
+def get_storage_backend() -> StorageBackend:
+    if MEDIA_BACKEND == "local":
+        return LocalStorageBackend(MEDIA_ROOT, MEDIA_BASE_URL)
+    if MEDIA_BACKEND == "imagekit":
+        return ImageKitBackend()
+    raise ValueError(f"Unknown MEDIA_BACKEND: {MEDIA_BACKEND}")
+
+
+storage = get_storage_backend()
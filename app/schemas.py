@@ -1,3 +1,5 @@
+from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel
 from fastapi_users import schemas
 import uuid
@@ -32,6 +34,51 @@ class CommentResponse(BaseModel):
     created_at: str  # We'll convert datetime to string in the endpoint or use Config
 
 
+# Read models below also describe sparse `fields=` responses, so every field is optional.
+# The handlers return ORJSONResponse directly; dump_items does the field filtering.
+class CommentRead(BaseModel):
+    id: Optional[uuid.UUID] = None
+    user_id: Optional[uuid.UUID] = None
+    email: Optional[str] = None
+    content: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
+class CommentListResponse(BaseModel):
+    comments: list[CommentRead]
+
+
+class PostRead(BaseModel):
+    id: Optional[uuid.UUID] = None
+    user_id: Optional[uuid.UUID] = None
+    caption: Optional[str] = None
+    url: Optional[str] = None
+    file_type: Optional[str] = None
+    file_name: Optional[str] = None
+    created_at: Optional[datetime] = None
+    is_owner: Optional[bool] = None
+    email: Optional[str] = None
+    like_count: Optional[int] = None
+    comment_count: Optional[int] = None
+    is_liked: Optional[bool] = None
+    variants: Optional[dict[str, str]] = None
+    srcset: Optional[str] = None
+
+
+class FeedResponse(BaseModel):
+    posts: list[PostRead]
+
+
+def dump_items(model: type[BaseModel], rows: list[dict], selected: Optional[set[str]]) -> list[dict]:
+    """Rows keyed by `model`'s fields (or the requested subset), so the payload always matches the schema.
+
+    A row missing a field raises KeyError instead of silently drifting from the model. Values are
+    not validated and stay UUID/datetime for orjson to encode natively.
+    """
+    names = [name for name in model.model_fields if selected is None or name in selected]
+    return [{name: row[name] for name in names} for row in rows]
+
+
 class LikeCreate(BaseModel):
     pass  # No body needed for like toggle
 
@@ -0,0 +1,70 @@
+"""Serialization cost of one /feed page: the old jsonable_encoder path vs the orjson path.
+
+Run from the project root:  python -m benchmarks.bench_serialization
+"""
+import timeit
+import uuid
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from app.schemas import PostRead, dump_items
+
+PAGE_SIZES = [20, 100, 500]
+REPEAT = 5
+SPARSE_FIELDS = {"id", "like_count", "comment_count"}
+
+
+def make_rows(count):
+    """Feed rows as get_feed builds them: UUIDs and datetimes left unconverted."""
+    user_id = uuid.uuid4()
+    variant_url = "http://localhost:8000/media/ab/cd/photo_0123456789_{}.webp"
+    return [
+        {
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "caption": f"Post number {i}",
+            "url": "http://localhost:8000/media/ab/cd/photo_0123456789.jpg",
+            "file_type": "image",
+            "file_name": "photo_0123456789.jpg",
+            "created_at": datetime.utcnow(),
+            "is_owner": True,
+            "email": "someone@example.com",
+            "like_count": i,
+            "comment_count": i // 2,
+            "is_liked": i % 2 == 0,
+            "variants": {name: variant_url.format(name) for name in ("thumb", "feed", "feed_hd")},
+            "srcset": ", ".join(f"{variant_url.format(name)} {w}w" for name, w in (("thumb", 320), ("feed", 720))),
+        }
+        for i in range(count)
+    ]
+
+
+def legacy_render(rows):
+    # Previous get_feed: per-field str()/isoformat(), then FastAPI's jsonable_encoder + json.dumps
+    posts = [{**row, "id": str(row["id"]), "user_id": str(row["user_id"]), "created_at": row["created_at"].isoformat()} for row in rows]
+    return JSONResponse(jsonable_encoder({"posts": posts})).body
+
+
+def orjson_render(rows):
+    # Current get_feed: rows go through PostRead, then straight to orjson
+    return ORJSONResponse({"posts": dump_items(PostRead, rows, None)}).body
+
+
+def sparse_render(rows):
+    return ORJSONResponse({"posts": dump_items(PostRead, rows, SPARSE_FIELDS)}).body
+
+
+def main():
+    print(f"{'page size':>10} {'path':>10} {'ms/page':>10} {'bytes':>10}")
+    for size in PAGE_SIZES:
+        rows = make_rows(size)
+        for name, render in (("legacy", legacy_render), ("orjson", orjson_render), ("sparse", sparse_render)):
+            number = max(1, 2000 // size)
+            best = min(timeit.repeat(lambda: render(rows), number=number, repeat=REPEAT)) / number
+            print(f"{size:>10} {name:>10} {best * 1000:>10.3f} {len(render(rows)):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import streamlit as st
 import requests
-import base64
-import urllib.parse
+import html
 from datetime import datetime
 import os
 
@@ -190,30 +189,16 @@ def upload_page():
                     st.error(f"Error: {e}")
 
 
-def encode_text_for_overlay(text):
-    if not text: return ""
-    base64_text = base64.b64encode(text.encode('utf-8')).decode('utf-8')
-    return urllib.parse.quote(base64_text)
-
-
-def create_transformed_url(original_url, transformation_params, caption=None):
-    if caption:
-        encoded_caption = encode_text_for_overlay(caption)
-        text_overlay = f"l-text,ie-{encoded_caption},ly-N20,lx-20,fs-50,co-white,bg-000000A0,l-end"
-        transformation_params = f"{transformation_params},{text_overlay}" if transformation_params else text_overlay
-
-    if not transformation_params:
-        return original_url
-
-    parts = original_url.split("/")
-    # Basic ImageKit URL parsing - assumes standard format
-    try:
-        imagekit_id = parts[3]
-        file_path = "/".join(parts[4:])
-        base_url = "/".join(parts[:4])
-        return f"{base_url}/tr:{transformation_params}/{file_path}"
-    except:
-        return original_url
+def responsive_image_html(post):
+    """<picture> over the server-generated variants so the browser fetches only the width it needs"""
+    variants = post['variants']
+    fallback = html.escape(variants.get('feed_jpg', post['url']))
+    return f"""
+    <picture>
+        <source type="image/webp" srcset="{html.escape(post['srcset'])}" sizes="(max-width: 768px) 100vw, 720px">
+        <img src="{fallback}" loading="lazy" style="width: 100%; border-radius: 12px;">
+    </picture>
+    """
 
 
 def feed_page():
@@ -247,7 +232,9 @@ def feed_page():
                 """, unsafe_allow_html=True)
 
                 # Media
-                if post['file_type'] == 'image':
+                if post['file_type'] == 'image' and post.get('srcset'):
+                    st.markdown(responsive_image_html(post), unsafe_allow_html=True)
+                elif post['file_type'] == 'image':
                     st.image(post['url'], use_container_width=True)
                 else:
                     st.video(post['url'])